@@ -1,13 +1,42 @@
 import os
+import asyncio
+import contextvars
+import fcntl
 import logging
 import random
+import signal
+import sqlite3
+import time
+import warnings
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
 from typing import Optional
 
+# פרופיל עלייה: זמן ה-import של התלויות הכבדות לעומת ה-init מול טלגרם
+IMPORT_STARTED = time.perf_counter()
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+    json_loads = json.loads
+    json_dumps = lambda obj: json.dumps(obj).encode()
+
+import httpx
 from fastapi import FastAPI, Request
-from telegram import Update, User
+from fastapi.responses import JSONResponse, PlainTextResponse
+from telegram import InlineQueryResultArticle, InputTextMessageContent, Update, User
 from telegram.ext import (
-    Application, CommandHandler, ContextTypes
+    Application, BaseRateLimiter, BaseUpdateProcessor, CommandHandler, ContextTypes, InlineQueryHandler
 )
+from telegram.error import BadRequest, RetryAfter
+from telegram.request import HTTPXRequest
+from telegram.warnings import PTBUserWarning
+
+STARTUP_PROFILE = {"imports": time.perf_counter() - IMPORT_STARTED}
 
 # --------------------
 # קונפיגורציה בסיסית
@@ -17,316 +46,985 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(mess
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 WEBHOOK_SECRET = os.environ["WEBHOOK_SECRET"]
 PUBLIC_URL = os.environ.get("PUBLIC_URL")
+# בלי PUBLIC_URL אין לאן לשלוח webhook - מושכים עדכונים ב-getUpdates (long polling)
+UPDATE_MODE = os.environ.get("UPDATE_MODE") or ("webhook" if PUBLIC_URL else "polling")
+POLL_LIMIT = min(int(os.environ.get("POLL_LIMIT", "100")), 100)
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", "50"))
+# עד כמה מחכים שה-batch יטופל לפני שמאשרים אותו לטלגרם (צ'אט חסום ב-rate limit לא עוצר את כולם)
+POLL_COMMIT_TIMEOUT = float(os.environ.get("POLL_COMMIT_TIMEOUT", "10"))
+POLL_ALLOWED_UPDATES = ["message", "edited_message", "inline_query"]
+# החזרת ה-sendMessage בתוך תשובת ה-webhook במקום קריאה נפרדת ל-Bot API
+WEBHOOK_REPLY = os.environ.get("WEBHOOK_REPLY", "0") == "1"
+WEBHOOK_REPLY_TIMEOUT = float(os.environ.get("WEBHOOK_REPLY_TIMEOUT", "1.5"))
+# cold start מהיר: uvicorn מקבל תעבורה מיד, ה-init מול טלגרם רץ ברקע ועדכונים שמגיעים בינתיים נשמרים בצד
+FAST_START = os.environ.get("FAST_START", "0") == "1"
+STARTUP_BUFFER_SIZE = int(os.environ.get("STARTUP_BUFFER_SIZE", "1000"))
+
+# שכבת ה-HTTP של הבוט - pool אחד חם מול api.telegram.org שמשרת את כל ה-handlers
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL", "https://api.telegram.org/bot")
+BOT_POOL_SIZE = int(os.environ.get("BOT_POOL_SIZE", "32"))
+BOT_KEEPALIVE_SECONDS = float(os.environ.get("BOT_KEEPALIVE_SECONDS", "120"))
+BOT_HTTP_VERSION = os.environ.get("BOT_HTTP_VERSION", "1.1")  # "2" דורש python-telegram-bot[http2]
+BOT_CONNECT_TIMEOUT = float(os.environ.get("BOT_CONNECT_TIMEOUT", "5"))
+BOT_READ_TIMEOUT = float(os.environ.get("BOT_READ_TIMEOUT", "5"))
+# כמה צ'אטים מטופלים במקביל (בתוך צ'אט אחד - תמיד לפי הסדר)
+CONCURRENT_CHATS = int(os.environ.get("CONCURRENT_CHATS", "8"))
+# תקרה לעדכונים שממתינים לטיפול - בעומס זורקים קודם עריכות ואחר כך את הישנים ביותר
+MAX_PENDING_UPDATES = int(os.environ.get("MAX_PENDING_UPDATES", "1000"))
+# פקודה שהגיעה ישנה מזה, או שחיכתה אצלנו בתור יותר מזה, כבר לא רלוונטית - מאשרים ולא עונים (0 = כבוי)
+MAX_UPDATE_AGE_SECONDS = float(os.environ.get("MAX_UPDATE_AGE_SECONDS", "60"))
+# חלון איחוד פקודות לכל צ'אט - ספאם של /at בתוך החלון מקבל איחול אחד (0 = כבוי)
+DEBOUNCE_SECONDS = float(os.environ.get("DEBOUNCE_SECONDS", "0"))
+# מחיקת הודעות הפקודה נאספת לכל צ'אט ויוצאת כ-deleteMessages אחד (עד 100 הודעות לקריאה)
+DELETE_BATCH_SIZE = min(int(os.environ.get("DELETE_BATCH_SIZE", "100")), 100)
+DELETE_FLUSH_SECONDS = float(os.environ.get("DELETE_FLUSH_SECONDS", "1.0"))
+DELETE_RETRIES = int(os.environ.get("DELETE_RETRIES", "3"))
+# מגבלות השליחה של טלגרם: ~30 הודעות לשנייה בסה"כ, ~20 הודעות לדקה בכל קבוצה
+GLOBAL_RATE_PER_SECOND = float(os.environ.get("GLOBAL_RATE_PER_SECOND", "30"))
+GROUP_RATE_PER_MINUTE = float(os.environ.get("GROUP_RATE_PER_MINUTE", "20"))
+GROUP_BURST = int(os.environ.get("GROUP_BURST", "5"))
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "2"))
+# טלגרם שולח שוב עדכון כשה-ack מתעכב (למשל ב-cold start) - זוכרים update_id-ים שכבר טופלו
+DEDUP_WINDOW_SECONDS = float(os.environ.get("DEDUP_WINDOW_SECONDS", "600"))
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_DB_PATH = os.environ.get("DEDUP_DB_PATH")  # קובץ SQLite - תופס כפילויות גם אחרי restart ובין workers
+# מספר תהליכי uvicorn (uvicorn עצמו קורא את WEB_CONCURRENCY כברירת מחדל ל---workers)
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", "1"))
+STATE_DIR = os.environ.get("STATE_DIR", "/tmp/sticky-bot")
+if WORKERS > 1:
+    # ב-multi-worker ה-state המשותף (כפילויות, debounce) יושב ב-SQLite אחד ב-STATE_DIR
+    os.makedirs(STATE_DIR, exist_ok=True)
+    DEDUP_DB_PATH = DEDUP_DB_PATH or os.path.join(STATE_DIR, "state.db")
+    # לכל worker יש rate limiter משלו: התקציב הגלובלי מתחלק ביניהם (הצ'אטים דביקים, אז העומס מתפזר),
+    # והתקציב של כל קבוצה נשאר מלא כי רק worker אחד שולח אליה
+    GLOBAL_RATE_PER_SECOND /= WORKERS
 SPECIAL_USER_IDS = [919782824]
 SPECIAL_CHAT_IDS = [-1003741813693]
+GREETING_COMMANDS = ("at", "ata")
+# מצב inline (@bot at / @bot ata): דפים מוכנים מראש, וה-cache של טלגרם עונה על שאילתות חוזרות
+INLINE_PAGE_SIZE = 50  # המקסימום ש-answerInlineQuery מקבל
+INLINE_CACHE_SECONDS = int(os.environ.get("INLINE_CACHE_SECONDS", "300"))
+# getUpdates ו-answerInlineQuery נשלחים בכוונה כ-JSON גולמי דרך do_api_request. האזהרה של PTB
+# מושתקת רק לשתי הקריאות האלה ורק מהמודול הזה; catch_warnings סביב await לא בטוח בין tasks
+warnings.filterwarnings(
+    "ignore",
+    message="Please use 'Bot\\.(getUpdates|answerInlineQuery)'",
+    category=PTBUserWarning,
+    module=__name__ + "$",
+)
 
 # --------------------
-# רשימות איחולים
+# מאגר האיחולים
 # --------------------
-GREETINGS_HM = [
-    "שיהיה לך טחורים בפה אמן !!",
-    "שתיפול לבור מלא עם האוטו וייכנס לך הוישר בתחת אמן !!",
-    "הלוואי וכל פעם שתכין שקשוקה הביצים יהיו קשות!",
-    "שכל פעם שתפתח פחית טונה היא תפריץ לך לעין",
-    "שיתקלקל לך המטען באמצע הלילה אמן",
-    "שירד מבול ויהיה לך חור במטרייה בדיוק מעל הראש",
-    "שתלך לים תפתח אבטיח והוא יהיה מפוצץ בגרעינים",
-    "שיהיה לך צרבת",
-    "שכל פעם שתכין קפה לא יהיה לך חלב",
-    "שתחפש חניה תחשוב שמצאת ובום קאיה פיקנטו",
-    "שייגמר לך הדלק בכביש 6",
-    "שתתעטש בדיוק כשאתה שותה מים",
-    "שתזמין אוכל והוא יגיע קר",
-    "שתיתקע בפקק ויהיה לך ראש צב",
-    "שתסבול משלשולים קשים",
-    "שתלבש מכנס לבן ותחרבן עליו",
-    "שתיתקע בלי נייר טואלט אמן",
-    "שיהיה לך עדכון לנייד בדיוק כשצריך לצאת מהבית",
-    "שתדרוך על מים עם גרביים",
-    "שיהיה לך ריח של קלמנטינה תקוע באף",
-    "שתתלבש יפה תכין קפה תבוא לצאת מהבית ויישפך עליך הכל",
-    "שיהיה לך חתך בפרצוף מהמכונת גילוח",
-    "שתחתוך לימון והוא ישפריץ לך לעין",
-    "שתיתן ביס בקרמבו והוא יהיה ריק מבפנים",
-    "שינעלו לך המפתחות בתוך האוטו",
-    "שייתקע לך במוח השיר מקרנה",
-    "שתלך למטבח ותשכח למה באת",
-    "שלא תהיה לך חניה ברחוב",
-    "שתכין קפה תשב לשתות ואז תגלה ששכחת סוכר",
-    "שתנקה את האוטו ויום למחרת יהיה מלא אבק",
-    "שתלבש גרביים ותגלה שיש חור קטן בדיוק בבוהן",
-    "שתכין פופקורן ויישארו מלא גרעינים",
-    "שתלך יחף בבית ותדרוך על לגו",
-    "שתשב על כיסא פלסטיק והוא יישבר ותתרסק",
-    "שתיכנס למיטה ותיזכר ששכחת לכבות את האור",
-    "שתשים כביסה ותמצא טישו שהתפרק בפנים",
-    "שתפתח במבה והיא תהיה פירורים",
-    "שתגיע הביתה עם פיפי דחוף תבוא לפתוח את הדלת וישבר לך המפתח בפנים",
-    "שיהיו לך אפצ'ים בנהיגה",
-    "שתסתובב יום שלם עם פטרוזיליה בשיניים",
-    "שיהיה לך כתם שמן בחולצה יקרה",
-    "שתדרוך על חרא בנעליים יקרות",
-    "שייכנס לך התחתון לתחת",
-    "שתבוא לסבתא תרצה לשתות ויהיה רק מים מהברז או קריסטל מנטה",
-    "שיהיה לך גירוד בגב בדיוק איפה שהיד לא מגיעה",
-    "שתשים כביסה לבנה וייכנס לך בטעות גרב אדומה שתצבע הכל בוורוד",
-    "שתעלה לאוטובוס ותגלה שאין לך יתרה ברב-קו",
-    "שתחמם אוכל במיקרו והצלחת תהיה רותחת אבל האוכל יישאר קפוא",
-    "שתשטוף כלים וייצא שפריץ מהברז שירטיב לך את כל החולצה בבטן",
-    "שתפתח קופסת גלידה במקפיא ותגלה שיש בפנים קציצות של סבתא",
-    "שתחכה שעה למעלית וכשהיא תגיע היא תהיה מלאה",
-    "שתפתח שקית צ'יפס והיא תתפוצץ לך בפרצוף וכל הרצפה תתמלא פירורים",
-    "שתקום בלילה לשירותים ותדפוק את הזרת ברגל של המיטה",
-    "שתנסה לקרוע נייר סופג וייצא לך משולש קטן ומעצבן",
-    "שתפתח אבוקדו ותגלה שהוא כולו שחור מבפנים",
-    "שתשלח הודעה בקבוצה של העבודה ותגלה שיש לך שגיאת כתיב מביכה",
-    "שתנסה לפתוח שקית בסופר והאצבעות שלך יהיו יבשות ולא יצליחו לפתוח אותה שעה",
-    "שתכין פסטה ותגלה שאין לך מסננת",
-    "שתהיה בשיחה חשובה וייכנס לך ממתין מהבנק",
-    "שייגמר לך הנייר טואלט בדיוק כשאתה לבד בבית",
-    "שתחכה בתור בדואר והפקידה תצא להפסקה בדיוק כשיגיע תורך",
-    "שתצא מהבית ותגלה שיש לך מדבקה של מחיר על הסוליה של הנעל",
-    "שתאכל ארטיק והוא ייפול מהמקל על החולצה בביס הראשון",
-    "שתנסה להדליק מזגן ביום חמסין ותגלה שנגמרו הסוללות בשלט",
-]
-GREETINGS_HF = [
-    "שיהיה לך טחורים בפה אמן !!",
-    "שתיפלי לבור מלא עם האוטו וייכנס לך הוישר בתחת אמן !!",
-    "הלוואי וכל פעם שתכיני שקשוקה הביצים יהיו קשות!",
-    "שכל פעם שתפתחי פחית טונה היא תפריץ לך לעין",
-    "שיתקלקל לך המטען באמצע הלילה אמן",
-    "שירד מבול ויהיה לך חור במטרייה בדיוק מעל הראש",
-    "שתלכי לים תפתחי אבטיח והוא יהיה מפוצץ בגרעינים",
-    "שיהיה לך צרבת",
-    "שכל פעם שתכיני קפה לא יהיה לך חלב",
-    "שתחפשי חניה תחשבי שמצאת ובום קאיה פיקנטו",
-    "שיגמר לך הדלק בכביש 6",
-    "שתתעטשי בדיוק כשאת שותה מים",
-    "שתזמיני אוכל והוא יגיע קר",
-    "שתיתקעי בפקק ויהיה לך ראש צב",
-    "שתסבלי משלשולים קשים",
-    "שתלבשי מכנס לבן ותקבלי מחזור",
-    "שתיתקעי בלי טמפון אמן",
-    "שיהיה לך עדכון לנייד בדיוק כשצריך לצאת מהבית",
-    "שתדרכי על מים עם גרביים",
-    "שיהיה לך ריח של קלמנטינה תקוע באף",
-    "שתתלבשי יפה תכיני קפה תבואי לצאת מהבית ויישפך עלייך הכל",
-    "שיהיה לך כוויה בגבות מהשעווה",
-    "שתחתכי לימון והוא ישפריץ לך לעין",
-    "שתתני ביס בקרמבו והוא יהיה ריק מבפנים",
-    "שינעלו לך המפתחות בתוך האוטו",
-    "שיתקע לך במוח השיר מקרנה",
-    "שתלכי למטבח ותשכחי למה באת",
-    "שלא יהיה לך חניה ברחוב",
-    "שתכיני קפה תשבי לשתות ואז תגלי ששכחת סוכר",
-    "שתנקי את האוטו ויהיה מלא אבק",
-    "שתלבשי גרביים ותגלי שיש חור קטן בדיוק בבוהן",
-    "שתכיני פופקורן ויישארו מלא גרעינים",
-    "שתלכי יחפה בבית ותדרכי על לגו",
-    "שתשבי על כסא פלסטיק והוא יישבר ותתרסקי",
-    "שתיכנסי למיטה ותיזכרי ששכחת לכבות את האור",
-    "שתשימי כביסה ותמצאי טישו שהתפרק בפנים",
-    "שתפתחי במבה והיא תהיה פירורים",
-    "שתגיעי הביתה עם פיפי דחוף תבואי לפתוח את הדלת וישבר לך המפתח בפנים",
-    "שיהיה לך אפצ'ים בנהיגה",
-    "שתסתובבי יום שלם עם פטרוזיליה בשיניים",
-    "שיהיה לך כתם שמן בחולצה יקרה",
-    "שתדרכי על חרא בנעליים יקרות",
-    "שייכנס לך החוטיני לתחת",
-    "שתבואי לסבתא תרצי לשתות ויהיה רק מים מהברז או קריסטל מנטה",
-    "שיהיה לך גירוד בגב בדיוק איפה שהיד לא מגיעה",
-    "שתשימי כביסה לבנה וייכנס לך בטעות גרב אדומה שתצבע הכל בוורוד",
-    "שתעלי לאוטובוס ותגלי שאין לך יתרה ברב-קו",
-    "שתחממי אוכל במיקרו והצלחת תהיה רותחת אבל האוכל יישאר קפוא",
-    "שתשטפי כלים וייצא שפריץ מהברז שירטיב לך את כל החולצה בבטן",
-    "שתפתחי קופסת גלידה במקפיא ותגלי שיש בפנים קציצות של סבתא",
-    "שתחכיי שעה למעלית וכשהיא תגיע היא תהיה מלאה",
-    "שתפתחי שקית צ'יפס והיא תתפוצץ לך בפרצוף וכל הרצפה תתמלא פירורים",
-    "שתקומי בלילה לשירותים ותדפקי את הזרת ברגל של המיטה",
-    "שתנסי לקרוע נייר סופג וייצא לך משולש קטן ומעצבן",
-    "שתפתחי אבוקדו ותגלי שהוא כולו שחור מבפנים",
-    "שתשלחי הודעה בקבוצה של העבודה ותגלי שיש לך שגיאת כתיב מביכה",
-    "שתנסי לפתוח שקית בסופר והאצבעות שלך יהיו יבשות ולא יצליחו לפתוח אותה שעה",
-    "שתכיני פסטה ותגלי שאין לך מסננת",
-    "שתהיי בשיחה חשובה וייכנס לך ממתין מהבנק",
-    "שייגמר לך הנייר טואלט בדיוק כשאת לבד בבית",
-    "שתחכי בתור בדואר והפקידה תצא להפסקה בדיוק כשיגיע תורך",
-    "שתצאי מהבית ותגלי שיש לך מדבקה של מחיר על הסוליה של הנעל",
-    "שתאכלי ארטיק והוא ייפול מהמקל על החולצה בביס הראשון",
-    "שתנסי להדליק מזגן ביום חמסין ותגלי שנגמרו הסוללות בשלט",
-]
-
-GREETINGS_F = [
-    "שתמיד תזכרי שהחיים לא קורים לך — הם קורים בשבילך.",
-    "שתבחרי בעצמך גם בימים שאת שוכחת כמה את שווה.",
-    "שתהיי אמיצה מספיק להתחיל וחכמה מספיק לא לוותר.",
-    "שתמצאי את הדרך שלך גם כשכולם הולכים בכיוון אחר.",
-    "שתמיד תזכרי: הפחד הוא לפעמים רק סימן שאת בכיוון הנכון.",
-    "שתביני יום אחד שהכוח שחיפשת בחוץ תמיד היה בתוכך.",
-    "שתעשי לפחות דבר אחד ביום שמקרב אותך לחיים שאת באמת רוצה.",
-    "שתדעי לעצור לפעמים ולהגיד: וואלה… אני גאה בעצמי.",
-    "שהקפה שלך יהיה חזק כמו הביטחון העצמי שלך בבוקר.",
-    "שתמיד יהיה לך מקום חניה… גם בתל אביב.",
-    "שהמקרר שלך יהיה מלא גם כשלא עשית קניות.",
-    "שתכתבי משהו בקבוצה… וכולם יחשבו שזה חכם.",
-    "שתמיד יהיה לך מישהו שמאמין בך גם כשאת קצת שוכחת להאמין בעצמך.",
-    "שתפגשי אנשים טובים בדיוק בזמן שאת צריכה אותם.",
-    "שתזכרי שגם ימים קשים הם רק פרק — לא כל הסיפור.",
-    "שתמיד יהיה לך מקום שבו את יכולה להיות פשוט את.",
-    "שתמצאי רגעים קטנים של אושר גם בימים רגילים לגמרי.",
-    "שתפסיקי יום אחד לחכות לזמן הנכון — ופשוט תתחילי.",
-    "שתעזי לחלום בגדול גם אם זה מפחיד אחרים.",
-    "שתבחרי בדרך שלך גם אם היא פחות נוחה.",
-    "שתזכרי שהחיים קצרים מדי בשביל לחיות על אוטומט.",
-    "שתהיי הגרסה של עצמך שאנשים עוד לא פגשו.",
-    "שתהיה לך הצלחה גדולה בכל מה שאת נוגעת בו ✨",
-    "מאחלת לך יום מלא באנרגיה טובה וחיוכים 😊",
-    "שתגשימי את כל המטרות שלך צעד אחרי צעד 💪",
-    "מאחלת לך ביטחון עצמי ושקט פנימי היום 🌸",
-    "שתקבלי בשורות טובות ומשמחות 💛",
-    "שתהיי מוקפת באנשים שעושים לך טוב 🌷",
-    "מאחלת לך כוח להתמודד עם כל אתגר 💫",
-    "שתמצאי זמן גם לעצמך בתוך כל העומס 🌿",
-    "שתרגישי גאווה בכל התקדמות קטנה 🌟",
-    "מאחלת לך שלווה, הצלחה ובריאות 🌺",
-    "שתזכי להערכה שמגיעה לך 👑",
-    "מאחלת לך ימים קלים ולילות רגועים 🌙",
-    "שתמשיכי לזהור כמו שאת יודעת ✨",
-    "שתהיי חזקה מול כל מכשול 💪",
-    "מאחלת לך שפע והזדנויות חדשות 💎",
-    "שתחייכי יותר ותדאגי פחות 😄",
-    "שתקבלי החלטות בלב שלם 💖",
-    "מאחלת לך יום מלא השראה 🌼",
-    "שתמשיכי לגדול ולהתפתח בכל תחום 🌱",
-    "מאחלת לך הצלחות קטנות וגדולות כאחד 🎯",
-    "שתרגישי בטוחה בדרך שלך 🌷",
-    "שתפגשי אנשים שמרימים אותך למעלה 💛",
-    "מאחלת לך רגעים יפים ומרגשים 🌅",
-    "שתדעי שאת מסוגלת ליותר ממה שאת חושבת 💫",
-    "שתגשימי חלום אחד לפחות בקרוב ✨",
-    "מאחלת לך אושר אמיתי ופשוט 💖",
-    "שתהיה לך בהירות מחשבתית והחלטות חכמות 🧠",
-    "שתרגישי שלמה עם עצמך 🌸",
-    "מאחלת לך ימים של התקדמות ושקט 🌿",
-    "שתחווי הפתעה טובה היום 🎁",
-    "שתזכרי שגם מנוחה היא חלק מההתקדמות שלך. 🛌",
-    "שהבגדים שהזמנת באינטרנט תמיד יגיעו במידה המדויקת. 👗",
-    "שתהיי מספיק אמיצה להגיד 'לא' למה שלא עושה לך טוב. 🚫",
-    "שתמיד תמצאי את המילים הנכונות בזמן הנכון. 🗣️",
-    "שתדעי להעריך את הדרך שעברת, ולא רק את הפסגה. 🏔️",
-    "שתהיה לך סבלנות לעצמך גם בימים פחות מוצלחים. ✨",
-    "שהסוללה בטלפון תחזיק מעמד בדיוק עד שתגיעי למטען. 🔋",
-    "שתזכרי שאת לא צריכה להיות מושלמת כדי להיות מדהימה. 💖",
-    "שתהיה לך שנה של פחות 'צריכה' ויותר 'רוצה'. 🌟",
-    "שתמצאי סיבה אחת לפחות לצחוק בקול רם בכל יום. 😂",
-    "שתמיד יהיה לך שוקולד איכותי במגירה לזמני חירום. 🍫",
-    "שתקבלי מחמאה מאדם זר שתעשה לך את כל השבוע. 🌸",
-    "שתעיזי לבקש עזרה כשצריך – זה סימן של כוח, לא חולשה. 💪",
-    "שתצליחי לראות את היופי שכולם רואים בך. 📸",
-    "שתהיה לך תחושת בטן חדה שתמיד תוביל אותך למקום הנכון. 🧭",
-]
-
-GREETINGS_M = [
-    "שתמיד תזכור שהחיים לא קורים לך — הם קורים בשבילך.",
-    "שתבחר בעצמך גם בימים שאתה שוכח כמה אתה שווה.",
-    "שתהיה אמיץ מספיק להתחיל וחכם מספיק לא לוותר.",
-    "שתמצא את הדרך שלך גם כשכולם הולכים בכיוון אחר.",
-    "שתמיד תזכור: הפחד הוא לפעמים רק סימן שאתה בכיוון הנכון.",
-    "שתבין יום אחד שהכוח שחיפשת בחוץ תמיד היה בתוכך.",
-    "שתעשה לפחות דבר אחד ביום שמקרב אותך לחיים שאתה באמת רוצה.",
-    "שתדע לעצור לפעמים ולהגיד: וואלה… אני גאה בעצמי.",
-    "שהקפה שלך יהיה חזק כמו הביטחון העצמי שלך בבוקר.",
-    "שתמיד יהיה לך מקום חניה… גם בתל אביב.",
-    "שהמקרר שלך יהיה מלא גם כשלא עשית קניות.",
-    "שתכתוב משהו בקבוצה… וכולם יחשבו שזה חכם.",
-    "מאחלים לך שאראלה תתקשר אליך ושנה טובה.",
-    "שתמיד יהיה לך מישהו שמאמין בך גם כשאתה קצת שוכח להאמין בעצמך.",
-    "שתפגוש אנשים טובים בדיוק בזמן שאתה צריך אותם.",
-    "שתזכור שגם ימים קשים הם רק פרק — לא כל הסיפור.",
-    "שתמיד יהיה לך מקום שבו אתה יכול להיות פשוט אתה.",
-    "שתמצא רגעים קטנים של אושר גם בימים רגילים לגמרי.",
-    "שתפסיק יום אחד לחכות לזמן הנכון — ופשוט תתחיל.",
-    "שתעז לחלום בגדול גם אם זה מפחיד אחרים.",
-    "שתבחר בדרך שלך גם אם היא פחות נוחה.",
-    "שתזכור שהחיים קצרים מדי בשביל לחיות על אוטומט.",
-    "שתהיה הגרסה של עצמך שאנשים עוד לא פגשו.",
-    "שתהיה לך הצלחה גדולה בכל מה שאתה נוגע בו ✨",
-    "מאחל לך יום מלא באנרגיה טובה וחיוכים 😄",
-    "שתגשים את כל המטרות שלך צעד אחרי צעד 💪",
-    "מאחל לך ביטחון עצמי ושקט פנימי 🔥",
-    "שתקבל בשורות טובות ומשמחות 💛",
-    "שתהיה מוקף באנשים שעושים לך טוב 🤝",
-    "מאחל לך כוח להתמודד עם כל אתגר 💫",
-    "שתמצא זמן גם לעצמך בתוך כל העומס 🌿",
-    "שתרגיש גאווה בכל התקדמות קטנה 🌟",
-    "מאחל לך שלווה, הצלחה ובריאות 🕊️",
-    "שתזכה להערכה שמגיעה לך 👑",
-    "מאחל לך ימים קלים ולילות רגועים 🌙",
-    "שתמשיך לזהור כמו שאתה יודע ✨",
-    "שתהיה חזק מול כל מכשול 💪",
-    "מאחל לך שפע והזדמנויות חדשות 💎",
-    "שתחייך יותר ותדאג פחות 😄",
-    "שתקבל החלטות בלב שלם ❤️",
-    "מאחל לך יום מלא השראה 🌞",
-    "שתמשיך לגדול ולהתפתח בכל תחום 🌱",
-    "מאחל לך הצלחות קטנות וגדולות כאחד 🎯",
-    "שתרגיש בטוח בדרך שלך 🚀",
-    "שתפגוש אנשים שמרימים אותך למעלה 💛",
-    "מאחל לך רגעים יפים ומרגשים 🌅",
-    "שתדע שאתה מסוגלת ליותר ממה שאתה חושב 💫",
-    "שתגשים חלום אחד לפחות בקרוב ✨",
-    "מאחל לך אושר אמיתי ופשוט ❤️",
-    "שתהיה לך בהירות מחשבתית והחלטות חכמות 🧠",
-    "שתרגיש שלם עם עצמך 🌿",
-    "מאחל לך ימים של התקדמות ושקט 🕊️",
-    "שתחווה הפתעה טובה היום 🎁",
-    "שתזכור שגם מנוחה היא חלק מההתקדמות שלך. 🛌",
-    "שתמצא את המפתחות/ארנק/טלפון תמיד בניסיון הראשון. 🔑",
-    "שתהיה מספיק אמיץ להגיד 'לא' למה שלא עושה לך טוב. 🚫",
-    "שתמיד תמצא את המילים הנכונות בזמן הנכון. 🗣️",
-    "שתדע להעריך את הדרך שעברת, ולא רק את הפסגה. 🏔️",
-    "שתהיה לך סבלנות לעצמך גם בימים פחות מוצלחים. ✨",
-    "שהסוללה בטלפון תחזיק מעמד בדיוק עד שתגיע למטען. 🔋",
-    "שתזכור שאתה לא צריך להיות מושלם כדי להיות תותח. 🦁",
-    "שתהיה לך שנה של פחות 'חייב' ויותר 'בוחר'. 🌟",
-    "שתמצא סיבה אחת לפחות לצחוק בקול רם בכל יום. 😂",
-    "שתמיד יהיה איזה בירה קרה או נשנוש טוב בדיוק כשבא לך. 🍺",
-    "שתקבל הערכה מקצועית שתזכיר לך למה אתה מסוגל. 💼",
-    "שתעיז לבקש עזרה כשצריך – זה סימן של כוח, לא חולשה. 💪",
-    "שתצליח לראות את ההשפעה הטובה שיש לך על הסובבים אותך. 🙌",
-    "שתהיה לך תחושת בטן חדה שתמיד תוביל אותך למקום הנכון. 🧭",
-]
+# האיחולים יושבים ב-greetings.txt ונטענים מחדש כשהקובץ משתנה
+GREETINGS_PATH = os.environ.get("GREETINGS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "greetings.txt"))
+GREETINGS_CHECK_SECONDS = float(os.environ.get("GREETINGS_CHECK_SECONDS", "5"))
+GREETING_POOLS = ("hm", "hf", "f", "m")
+MAX_SHUFFLE_BAGS = int(os.environ.get("MAX_SHUFFLE_BAGS", "5000"))
+
+class GreetingCorpus:
+    # כל הקובץ נשמר כ-blob אחד של UTF-8, ולכל מאגר מערך offsets (התחלה, סוף) של המשפטים בו.
+    # הבחירה היא shuffle-bag לכל צ'אט: אין חזרות עד שהמאגר נגמר, ו-pick הוא pop אחד
+    def __init__(self, path: str, check_seconds: float, max_bags: int):
+        self.path = path
+        self.check_seconds = check_seconds
+        self.max_bags = max_bags
+        # (version, blob, pools) - מוחלף בהשמה אחת, כך שאף פעם לא רואים blob ישן עם offsets חדשים
+        self.state: tuple[int, bytes, dict[str, array]] = (0, b"", {})
+        self.bags: OrderedDict[tuple[int, str], tuple[int, array]] = OrderedDict()
+        self._stamp = None
+        self._checked_at = 0.0
+        self.reload()
+
+    @staticmethod
+    def parse(blob: bytes) -> dict[str, array]:
+        pools: dict[str, array] = {}
+        current = None
+        pos = 0
+        for line in blob.splitlines(keepends=True):
+            text = line.strip()
+            if text and not text.startswith(b"#"):
+                if text.startswith(b"[") and text.endswith(b"]"):
+                    current = pools.setdefault(text[1:-1].decode(), array("I"))
+                elif current is not None:
+                    start = pos + line.index(text)
+                    current.extend((start, start + len(text)))
+            pos += len(line)
+        return pools
+
+    def reload(self) -> bool:
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return False
+        with open(self.path, "rb") as f:
+            blob = f.read()
+        pools = self.parse(blob)
+        missing = [name for name in GREETING_POOLS if not pools.get(name)]
+        if missing:
+            raise ValueError(f"{self.path} has no greetings in: {', '.join(missing)}")
+        self.state = (self.state[0] + 1, blob, pools)
+        self._stamp = stamp
+        logging.info(f"Loaded greetings v{self.state[0]}: " + ", ".join(f"{n}={len(p) // 2}" for n, p in pools.items()))
+        return True
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = now
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            # קובץ שבור או חסר - ממשיכים עם הגרסה הקודמת
+            logging.error(f"Keeping greetings v{self.state[0]}, reload failed: {e}")
+
+    def pool(self, name: str) -> list[str]:
+        _, blob, pools = self.state
+        offsets = pools[name]
+        return [blob[offsets[i]:offsets[i + 1]].decode() for i in range(0, len(offsets), 2)]
+
+    def pick(self, chat_id: int, name: str) -> str:
+        self.maybe_reload()
+        version, blob, pools = self.state
+        offsets = pools[name]
+        key = (chat_id, name)
+        bag = self.bags.get(key)
+        if bag is None or bag[0] != version or not bag[1]:
+            order = list(range(len(offsets) // 2))
+            random.shuffle(order)
+            bag = self.bags[key] = (version, array("H" if len(order) < 1 << 16 else "I", order))
+            if len(self.bags) > self.max_bags:
+                self.bags.popitem(last=False)
+        self.bags.move_to_end(key)
+        i = bag[1].pop() * 2
+        return blob[offsets[i]:offsets[i + 1]].decode()
+
+greetings = GreetingCorpus(GREETINGS_PATH, GREETINGS_CHECK_SECONDS, MAX_SHUFFLE_BAGS)
 
 # --------------------
 # FastAPI + Telegram
 # --------------------
 api = FastAPI()
-application = Application.builder().token(BOT_TOKEN).build()
 
-# ====== Helpers ======
+# ====== Metrics ======
+# הכל מוקצה מראש: ב-hot path יש רק הוספה למונה קיים, בלי dict-ים של labels לכל בקשה
+
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+SLOW_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BOT_API_METHODS = (
+    "sendMessage", "deleteMessage", "deleteMessages", "answerInlineQuery", "getMe", "setWebhook", "other"
+)
+SWALLOWED_PATHS = ("delete_bulk", "delete_one", "fallback")
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        sep = "," if labels else ""
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+        return lines
+
+class Metrics:
+    def __init__(self):
+        # מהגעת הבקשה ועד ההחלטה אם לטפל (קריאת הגוף, JSON, סינון) - זה כל מה שעדכון שנזרק עולה
+        self.webhook_parse = Histogram(FAST_BUCKETS)
+        # בדיקת כפילות + Update.de_json - רק לעדכונים שעברו את הסינון
+        self.webhook_decode = Histogram(FAST_BUCKETS)
+        self.queue_wait = Histogram(SLOW_BUCKETS)
+        self.handler = {command: Histogram(SLOW_BUCKETS) for command in (*GREETING_COMMANDS, "inline")}
+        self.bot_api = {method: Histogram(SLOW_BUCKETS) for method in BOT_API_METHODS}
+        self.bot_api_errors = dict.fromkeys(BOT_API_METHODS, 0)
+        self.swallowed = dict.fromkeys(SWALLOWED_PATHS, 0)
+
+    def bot_api_method(self, endpoint: str) -> str:
+        return endpoint if endpoint in self.bot_api else "other"
+
+metrics = Metrics()
+
+class QueuedUpdate:
+    __slots__ = ("coroutine", "done", "update", "queued_at", "low_priority")
+
+    def __init__(self, coroutine, done: asyncio.Future, update: object, low_priority: bool):
+        self.coroutine = coroutine
+        self.done = done
+        self.update = update
+        self.queued_at = time.perf_counter()
+        self.low_priority = low_priority
+
+class ChatRunner:
+    # העדכון שרץ עכשיו בצ'אט - כדי שה-rate limiter יוכל לשחרר את ה-worker שלו
+    __slots__ = ("processor", "chat", "task", "worker")
+
+    def __init__(self, processor: "ChatOrderedUpdateProcessor", chat: int):
+        self.processor = processor
+        self.chat = chat
+        self.task = asyncio.current_task()
+        self.worker: Optional[int] = None
+
+current_worker: contextvars.ContextVar[Optional[ChatRunner]] = contextvars.ContextVar("current_worker", default=None)
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    # לכל צ'אט תור משלו; צ'אט מקבל worker רק כשיש לו עבודה, ולכל היותר workers צ'אטים רצים
+    # במקביל. באותו צ'אט התשובה והמחיקה לעולם לא מתחרות עם הפקודה הבאה, ושני צ'אטים לא
+    # חולקים תור. סך העדכונים שבטיפול (ממתינים + רצים) חסום ב-max_pending; עדכון שנזרק מקבל ack מיד בלי תשובה
+    def __init__(self, workers: int, max_pending: int, max_age: float):
+        self.max_pending = max(max_pending, 1)
+        # ה-semaphore של PTB גדול באחד מהתקרה שלנו, כך שעדכון חדש תמיד מגיע ל-do_process_update
+        # ושם מחליטים מה לזרוק; ההגבלה האמיתית על המקביליות היא ה-workers כאן
+        super().__init__(max_concurrent_updates=self.max_pending + 1)
+        self.max_age = max_age
+        # צ'אט כאן = יש לו runner
+        self.chats: dict[int, deque[QueuedUpdate]] = {}
+        # worker פנוי = אינדקס בתור; מי שמחכה ל-worker נכנס לפי הסדר
+        self.free_workers: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(workers):
+            self.free_workers.put_nowait(i)
+        self.active = 0
+        self.pending = 0
+        self.low_pending = 0
+        self.high_water = 0
+        self.throttled = 0
+        self.shed = {"overflow": 0, "stale": 0}
+        self.current_chat: list[Optional[int]] = [None] * workers
+        self.in_flight = [0] * workers
+        self.processed = [0] * workers
+        self._runners: set[asyncio.Task] = set()
+
+    @staticmethod
+    def route_key(update: object) -> int:
+        if isinstance(update, Update):
+            if update.effective_chat:
+                return update.effective_chat.id
+            if update.effective_user:
+                return update.effective_user.id
+        return 0
+
+    async def do_process_update(self, update, coroutine):
+        # רק /at ו-/ata בהודעה חדשה הם בעדיפות מלאה; עריכות ושאר העדכונים נזרקים ראשונים
+        entry = QueuedUpdate(
+            coroutine,
+            asyncio.get_running_loop().create_future(),
+            update,
+            not (isinstance(update, Update) and update.message),
+        )
+        self.active += 1
+        try:
+            if self.active > self.max_pending:
+                victim = self._evict()
+                if victim is None:
+                    # כל מה שבטיפול כבר רץ - אין את מי להוציא מהתור, זורקים את החדש
+                    self._shed(entry, "overflow")
+                    return
+                self._shed(victim, "overflow")
+            key = self.route_key(update)
+            queue = self.chats.get(key)
+            if queue is None:
+                queue = self.chats[key] = deque()
+                runner = asyncio.create_task(self._run_chat(key, queue))
+                self._runners.add(runner)
+                runner.add_done_callback(self._runners.discard)
+            queue.append(entry)
+            self.pending += 1
+            self.low_pending += entry.low_priority
+            self.high_water = max(self.high_water, self.pending)
+            await entry.done
+        finally:
+            self.active -= 1
+
+    def _evict(self) -> Optional[QueuedUpdate]:
+        # הרשומה הישנה ביותר מבין אלה בעדיפות נמוכה, ואם אין כאלה - הישנה ביותר בכלל
+        victim = None
+        for queue in self.chats.values():
+            for i, entry in enumerate(queue):
+                if entry.low_priority or not self.low_pending:
+                    if victim is None or entry.queued_at < victim[0].queued_at:
+                        victim = (entry, queue, i)
+                    break
+        if victim is None:
+            return None
+        entry, queue, i = victim
+        del queue[i]
+        self.pending -= 1
+        self.low_pending -= entry.low_priority
+        return entry
+
+    def _shed(self, entry: QueuedUpdate, reason: str):
+        entry.coroutine.close()
+        entry.done.set_result(None)
+        if isinstance(entry.update, Update):
+            reply_via_webhook(entry.update, None)
+        self.shed[reason] += 1
+
+    async def _run_chat(self, key: int, queue: deque[QueuedUpdate]):
+        # רץ כל עוד לצ'אט יש עבודה; worker נלקח לכל עדכון ומוחזר אחריו, כך שצ'אט עמוס לא מרעיב אחרים
+        runner = ChatRunner(self, key)
+        current_worker.set(runner)
+        try:
+            while queue:
+                worker = await self.free_workers.get()
+                if not queue:
+                    # הרשומה האחרונה נזרקה בזמן שחיכינו
+                    self.free_workers.put_nowait(worker)
+                    break
+                entry = queue.popleft()
+                self.pending -= 1
+                self.low_pending -= entry.low_priority
+                # הגיל לפי טלגרם נבדק בכניסה (is_stale); כאן - כמה זמן העדכון חיכה אצלנו
+                if self.max_age > 0 and time.perf_counter() - entry.queued_at > self.max_age:
+                    self._shed(entry, "stale")
+                    self.free_workers.put_nowait(worker)
+                    continue
+                metrics.queue_wait.observe(time.perf_counter() - entry.queued_at)
+                self._occupy(runner, worker)
+                try:
+                    await entry.coroutine
+                    entry.done.set_result(None)
+                except Exception as e:
+                    entry.done.set_exception(e)
+                finally:
+                    # ה-worker יכול להתחלף אם ה-handler חיכה ל-rate limiter באמצע
+                    if runner.worker is not None:
+                        self.processed[runner.worker] += 1
+                        self._release(runner)
+                # נותנים לצ'אט שכבר מחכה ל-worker לקחת אותו לפני שאנחנו חוזרים לתור
+                await asyncio.sleep(0)
+        finally:
+            del self.chats[key]
+
+    def _occupy(self, runner: ChatRunner, worker: int):
+        runner.worker = worker
+        self.current_chat[worker] = runner.chat
+        self.in_flight[worker] = 1
+
+    def _release(self, runner: ChatRunner):
+        worker = runner.worker
+        runner.worker = None
+        self.current_chat[worker] = None
+        self.in_flight[worker] = 0
+        self.free_workers.put_nowait(worker)
+
+    async def sleep_off_worker(self, runner: ChatRunner, delay: float):
+        # צ'אט שמחכה לתקציב שלו (מגבלת קבוצה / RetryAfter) לא מחזיק worker - צ'אטים אחרים ממשיכים,
+        # והסדר בתוך הצ'אט נשמר כי ה-runner שלו עדיין מחכה לאותו handler
+        self._release(runner)
+        self.throttled += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.throttled -= 1
+        self._occupy(runner, await self.free_workers.get())
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        for runner in list(self._runners):
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+
+    def stats(self) -> list[dict]:
+        # queued - כמה ממתינים בצ'אט שה-worker מטפל בו עכשיו
+        return [
+            {
+                "worker": i,
+                "chat": chat,
+                "queued": len(self.chats.get(chat, ())) if chat is not None else 0,
+                "in_flight": self.in_flight[i],
+                "processed": self.processed[i],
+            }
+            for i, chat in enumerate(self.current_chat)
+        ]
+
+async def sleep_off_worker(delay: float):
+    runner = current_worker.get()
+    # tasks שנוצרו מתוך handler (למשל flush של מחיקות) יורשים את ה-context אבל לא את ה-worker
+    if runner is None or runner.worker is None or runner.task is not asyncio.current_task():
+        # מחוץ ל-handler (מחיקות, bootstrap) - אין worker לשחרר
+        await asyncio.sleep(delay)
+        return
+    await runner.processor.sleep_off_worker(runner, delay)
+
+class DeletionBuffer:
+    # מאגר מחיקות לכל צ'אט: נשלח כשמגיעים ל-batch_size או אחרי flush_seconds מההודעה הראשונה
+    def __init__(self, batch_size: int, flush_seconds: float, retries: int):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.retries = retries
+        self.pending: dict[int, list[int]] = {}
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self._flushes: set[asyncio.Task] = set()
+
+    def add(self, chat_id: int, message_ids: list[int]):
+        ids = self.pending.setdefault(chat_id, [])
+        ids.extend(message_ids)
+        if len(ids) >= self.batch_size:
+            self.flush(chat_id)
+        elif chat_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(self.flush_seconds, self.flush, chat_id)
+
+    def flush(self, chat_id: int):
+        timer = self._timers.pop(chat_id, None)
+        if timer:
+            timer.cancel()
+        ids = self.pending.pop(chat_id, None)
+        if ids:
+            task = asyncio.create_task(self._delete(chat_id, ids))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def drain(self):
+        for chat_id in list(self.pending):
+            self.flush(chat_id)
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    async def _delete(self, chat_id: int, message_ids: list[int]):
+        for i in range(0, len(message_ids), self.batch_size):
+            chunk = message_ids[i:i + self.batch_size]
+            try:
+                await application.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+            except BadRequest as e:
+                # deleteMessages כבר מדלג על הודעות שאי אפשר למחוק, אז BadRequest הוא בעיה של כל
+                # הצ'אט (בדרך כלל אין לבוט הרשאת מחיקה) - מחיקה אחת-אחת רק תכפיל את הכישלון
+                metrics.swallowed["delete_bulk"] += 1
+                logging.warning(f"deleteMessages rejected in chat {chat_id}: {e}")
+                return
+            except Exception as e:
+                metrics.swallowed["delete_bulk"] += 1
+                logging.warning(f"deleteMessages failed in chat {chat_id} ({e}), retrying one by one")
+                await asyncio.gather(*(self._delete_one(chat_id, mid) for mid in chunk))
+
+    async def _delete_one(self, chat_id: int, message_id: int):
+        for attempt in range(self.retries):
+            try:
+                await application.bot.delete_message(chat_id=chat_id, message_id=message_id)
+                return
+            except BadRequest as e:
+                # ההודעה כבר נמחקה / ישנה מדי / אין הרשאה - ניסיון נוסף לא יעזור
+                metrics.swallowed["delete_one"] += 1
+                logging.info(f"Not deleting message {message_id} in chat {chat_id}: {e}")
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                metrics.swallowed["delete_one"] += 1
+                logging.warning(f"Error deleting message {message_id} in chat {chat_id}: {e}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        logging.error(f"Giving up deleting message {message_id} in chat {chat_id}")
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # כמה זמן עד שיש token פנוי (0 = אפשר עכשיו)
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class TelegramRateLimiter(BaseRateLimiter):
+    # כל קריאה של context.bot עוברת כאן: bucket גלובלי + bucket לכל קבוצה.
+    # תשובות קודמות למחיקות, ו-RetryAfter עוצר רק את הצ'אט שקיבל אותו
+    MAX_CHAT_BUCKETS = 10_000
+
+    def __init__(self, global_rate: float, group_rate_per_minute: float, group_burst: int, max_retries: int):
+        self.global_rate = global_rate
+        self.group_rate = group_rate_per_minute / 60
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self._global: Optional[TokenBucket] = None
+        self._chats: dict[int, TokenBucket] = {}
+        self._paused_until: dict[Optional[int], float] = {}
+        self._replies_waiting = 0
+        # priority -> [calls, total wait, max wait]
+        self.waits = {"reply": [0, 0.0, 0.0], "cleanup": [0, 0.0, 0.0]}
+
+    async def initialize(self):
+        self._global = TokenBucket(self.global_rate, self.global_rate, asyncio.get_running_loop().time())
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # מפנים buckets מלאים - צ'אטים שלא שלחו כלום לאחרונה
+                self._chats = {c: b for c, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.group_rate, self.group_burst, now)
+        return bucket
+
+    def _delay(self, chat_id: Optional[int], is_reply: bool, now: float) -> float:
+        delay = 0.0
+        for key in (None, chat_id):
+            paused = self._paused_until.get(key)
+            if paused is not None:
+                if paused <= now:
+                    del self._paused_until[key]
+                else:
+                    delay = max(delay, paused - now)
+        # רק הודעות בקבוצות נספרות בתקציב של הקבוצה; מחיקות רק בגלובלי
+        if is_reply and chat_id is not None and chat_id < 0:
+            delay = max(delay, self._chat_bucket(chat_id, now).delay(now))
+        delay = max(delay, self._global.delay(now))
+        if not is_reply and self._replies_waiting:
+            delay = max(delay, 1 / self.global_rate)
+        return delay
+
+    def _take(self, chat_id: Optional[int], is_reply: bool):
+        self._global.tokens -= 1
+        if is_reply and chat_id is not None and chat_id < 0:
+            self._chats[chat_id].tokens -= 1
+
+    def try_acquire(self, chat_id: int) -> bool:
+        # לתשובה שיוצאת בגוף ה-webhook: לוקחים token רק אם הוא פנוי עכשיו, בלי לחכות
+        if self._global is None or self._delay(chat_id, True, asyncio.get_running_loop().time()) > 0:
+            return False
+        self._take(chat_id, True)
+        self._record("reply", 0.0)
+        return True
+
+    async def _acquire(self, chat_id: Optional[int], is_reply: bool):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        now = started
+        delay = self._delay(chat_id, is_reply, now)
+        queued = False
+        try:
+            while delay > 0:
+                # רק תשובה שנתקעה על ה-bucket הגלובלי מעכבת מחיקות; המתנה לתקציב של הקבוצה
+                # או ל-RetryAfter של הצ'אט לא נוגעת לצ'אטים אחרים
+                blocked = is_reply and self._global.delay(now) > 0
+                if blocked != queued:
+                    self._replies_waiting += 1 if blocked else -1
+                    queued = blocked
+                await sleep_off_worker(delay)
+                now = loop.time()
+                delay = self._delay(chat_id, is_reply, now)
+        finally:
+            if queued:
+                self._replies_waiting -= 1
+        self._take(chat_id, is_reply)
+        self._record("reply" if is_reply else "cleanup", loop.time() - started)
+
+    def _record(self, priority: str, waited: float):
+        stats = self.waits[priority]
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if not isinstance(chat_id, int):
+            chat_id = None
+        if endpoint == "getUpdates":
+            # long poll - לא שליחה, לא צורך tokens ולא נעצר ב-flood control של צ'אט
+            return await callback(*args, **kwargs)
+        is_reply = not endpoint.startswith("delete")
+        # תשובה ל-inline query היא לא הודעה בצ'אט - לא נספרת במגבלות השליחה
+        limited = endpoint != "answerInlineQuery"
+        method = metrics.bot_api_method(endpoint)
+        if limited:
+            await self._acquire(chat_id, is_reply)
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                metrics.bot_api_errors[method] += 1
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Flood control on {endpoint} in chat {chat_id}, pausing {e.retry_after}s")
+                if not limited:
+                    await sleep_off_worker(e.retry_after)
+                    continue
+                self._paused_until[chat_id] = asyncio.get_running_loop().time() + e.retry_after
+            except Exception:
+                metrics.bot_api_errors[method] += 1
+                raise
+            finally:
+                metrics.bot_api[method].observe(time.perf_counter() - started)
+            await self._acquire(chat_id, is_reply)
+
+    def stats(self) -> dict:
+        return {
+            priority: {"calls": calls, "avg_wait": total / calls if calls else 0.0, "max_wait": worst}
+            for priority, (calls, total, worst) in self.waits.items()
+        }
+
+class UpdateDeduplicator:
+    # OrderedDict לפי זמן הגעה: בדיקה ב-O(1), והישנים ביותר תמיד בהתחלה - פינוי זול וזיכרון חסום
+    PRUNE_EVERY = 500
+
+    def __init__(self, window: float, max_entries: int, db_path: Optional[str] = None):
+        self.window = window
+        self.max_entries = max_entries
+        self.seen: OrderedDict[int, float] = OrderedDict()
+        self.db: Optional[sqlite3.Connection] = None
+        self._inserts = 0
+        if db_path:
+            # כתיבה מקומית קצרה אחת לעדכון; WAL מאפשר לכמה תהליכים לעבוד על אותו קובץ
+            self.db = sqlite3.connect(db_path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS seen_updates_seen_at ON seen_updates (seen_at)")
+
+    def is_duplicate(self, update_id: int) -> bool:
+        now = time.time()
+        cutoff = now - self.window
+        while self.seen and next(iter(self.seen.values())) < cutoff:
+            self.seen.popitem(last=False)
+
+        duplicate = update_id in self.seen
+        if not duplicate and self.db is not None:
+            inserted = self.db.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, now)
+            ).rowcount
+            duplicate = inserted == 0
+            self._inserts += 1
+            if self._inserts % self.PRUNE_EVERY == 0:
+                self.db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (cutoff,))
+
+        if duplicate:
+            return True
+        self.seen[update_id] = now
+        if len(self.seen) > self.max_entries:
+            self.seen.popitem(last=False)
+        return False
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+class WorkerCluster:
+    # כמה תהליכי uvicorn על אותו host. כל תהליך תופס slot עם flock, כל צ'אט שייך תמיד ל-slot
+    # אחד, ועדכון שהגיע ל-worker אחר מועבר לבעלים ב-unix socket (frame = אורך 4 בתים + JSON)
+    def __init__(self, size: int, state_dir: str):
+        self.size = size
+        self.state_dir = state_dir
+        self.slot: Optional[int] = None
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: dict[int, asyncio.StreamWriter] = {}
+        self.forwarded = 0
+        self.received = 0
+        self._claims = 0
+        self.db = sqlite3.connect(
+            os.path.join(state_dir, "state.db"), timeout=1.0, isolation_level=None, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # הכתיבה כאן רצה על ה-event loop בכל פקודה; ב-WAL אין צורך ב-fsync לכל commit
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS debounce_windows ("
+            "chat_id INTEGER NOT NULL, reply_to_id INTEGER NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, reply_to_id))"
+        )
+
+    def _socket_path(self, slot: int) -> str:
+        return os.path.join(self.state_dir, f"worker-{slot}.sock")
+
+    def claim_slot(self) -> Optional[int]:
+        for slot in range(self.size):
+            lock_file = open(os.path.join(self.state_dir, f"worker-{slot}.lock"), "w")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            # ה-lock משתחרר לבד כשהתהליך מת, וה-worker שיקום במקומו יתפוס את אותו slot
+            self._lock_file = lock_file
+            self.slot = slot
+            return slot
+        return None
+
+    def owner(self, chat_id: int) -> int:
+        return chat_id % self.size
+
+    async def start(self, on_update):
+        if self.claim_slot() is None:
+            logging.warning("No free worker slot, handling every chat in this process")
+            return
+        path = self._socket_path(self.slot)
+        if os.path.exists(path):
+            os.unlink(path)
+
+        async def serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                while True:
+                    size = int.from_bytes(await reader.readexactly(4), "big")
+                    self.received += 1
+                    body = await reader.readexactly(size)
+                    # עדכון אחד שנכשל לא סוגר את החיבור - כל מה שה-worker השני שולח אחריו היה הולך לאיבוד
+                    try:
+                        await on_update(json_loads(body))
+                    except Exception:
+                        logging.exception(f"Failed to handle update forwarded to slot {self.slot}")
+            except asyncio.IncompleteReadError:
+                pass
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_unix_server(serve, path=path)
+        logging.info(f"Worker slot {self.slot}/{self.size} listening on {path}")
+
+    async def forward(self, slot: int, body: bytes) -> bool:
+        try:
+            writer = self._peers.get(slot)
+            if writer is None or writer.is_closing():
+                _, writer = await asyncio.open_unix_connection(self._socket_path(slot))
+                self._peers[slot] = writer
+            writer.write(len(body).to_bytes(4, "big") + body)
+            await writer.drain()
+        except OSError as e:
+            logging.warning(f"Worker slot {slot} unreachable ({e}), handling update locally")
+            self._peers.pop(slot, None)
+            return False
+        self.forwarded += 1
+        return True
+
+    def claim_debounce_window(self, chat_id: int, reply_to_id: Optional[int], seconds: float) -> bool:
+        # True אם נפתח חלון חדש; False אם יש חלון פתוח (גם אם נפתח ב-worker אחר)
+        now = time.time()
+        self._claims += 1
+        if self._claims % 500 == 0:
+            self.db.execute("DELETE FROM debounce_windows WHERE expires_at <= ?", (now,))
+        return self.db.execute(
+            "INSERT INTO debounce_windows (chat_id, reply_to_id, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (chat_id, reply_to_id) DO UPDATE SET expires_at = excluded.expires_at "
+            "WHERE debounce_windows.expires_at <= ?",
+            (chat_id, reply_to_id or 0, now + seconds, now),
+        ).rowcount == 1
+
+    async def stop(self):
+        # מפסיקים לקבל ולהעביר עדכונים; ה-DB וה-slot נשארים עד שה-handlers שבדרך מסיימים
+        for writer in self._peers.values():
+            writer.close()
+        self._peers.clear()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            if os.path.exists(self._socket_path(self.slot)):
+                os.unlink(self._socket_path(self.slot))
+
+    def close(self):
+        self.db.close()
+        if self._lock_file:
+            self._lock_file.close()
+
+    def stats(self) -> dict:
+        return {"slot": self.slot, "size": self.size, "forwarded": self.forwarded, "received": self.received}
+
+def build_bot_request() -> HTTPXRequest:
+    # ברירת המחדל של httpx סוגרת חיבור אחרי 5 שניות idle - ואז כל פקודה משלמת על TLS handshake
+    limits = httpx.Limits(
+        max_connections=BOT_POOL_SIZE,
+        max_keepalive_connections=BOT_POOL_SIZE,
+        keepalive_expiry=BOT_KEEPALIVE_SECONDS,
+    )
+    return HTTPXRequest(
+        connection_pool_size=BOT_POOL_SIZE,
+        connect_timeout=BOT_CONNECT_TIMEOUT,
+        read_timeout=BOT_READ_TIMEOUT,
+        write_timeout=BOT_READ_TIMEOUT,
+        http_version=BOT_HTTP_VERSION,
+        httpx_kwargs={"limits": limits},
+    )
+
+application = (
+    Application.builder()
+    .token(BOT_TOKEN)
+    .base_url(BOT_API_BASE_URL)
+    .request(build_bot_request())
+    .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_CHATS, MAX_PENDING_UPDATES, MAX_UPDATE_AGE_SECONDS))
+    .rate_limiter(TelegramRateLimiter(GLOBAL_RATE_PER_SECOND, GROUP_RATE_PER_MINUTE, GROUP_BURST, RATE_LIMIT_RETRIES))
+    .build()
+)
+
+deletions = DeletionBuffer(DELETE_BATCH_SIZE, DELETE_FLUSH_SECONDS, DELETE_RETRIES)
+deduplicator = UpdateDeduplicator(DEDUP_WINDOW_SECONDS, DEDUP_MAX_ENTRIES, DEDUP_DB_PATH)
+cluster = WorkerCluster(WORKERS, STATE_DIR) if WORKERS > 1 else None
+
+# מונים של ה-fast path ב-webhook
+WEBHOOK_STATS = {"dropped": 0, "stale": 0, "duplicates": 0, "dispatched": 0, "startup_dropped": 0}
+
+# update_id -> Future שה-webhook מחכה עליו במצב WEBHOOK_REPLY
+webhook_replies: dict[int, asyncio.Future] = {}
 
-def pick_random_greeting(is_female: bool) -> str:
-    pool = GREETINGS_F if is_female else GREETINGS_M
-    return random.choice(pool)
+# (chat_id, reply_to_id) -> הודעות הפקודה של החלון הפתוח; נמחק כשהחלון נסגר
+debounce_windows: dict[tuple[int, Optional[int]], list[int]] = {}
+
+# מאגר -> (גרסת greetings, דפים של (תוצאות, אותן תוצאות כ-JSON))
+inline_pages: dict[str, tuple[int, list[tuple[list[dict], str]]]] = {}
+
+# עדכונים שהגיעו לפני שהבוט סיים לעלות (FAST_START) - מטופלים כשה-init מסתיים
+startup_buffer: deque[tuple[bytes, float]] = deque(maxlen=STARTUP_BUFFER_SIZE)
+bot_ready = asyncio.Event()
+startup_failed = False
+startup_task: Optional[asyncio.Task] = None
+poller_task: Optional[asyncio.Task] = None
+POLL_STATS = {"batches": 0, "updates": 0, "commit_timeouts": 0}
+
+# ====== Helpers ======
 
 def is_special_user(user: Optional[User]) -> bool:
     return bool(user and user.id in SPECIAL_USER_IDS)
 
+def is_greeting_command(data: dict) -> bool:
+    # אותה בדיקה כמו CommandHandler, אבל על ה-JSON הגולמי בלי לבנות אובייקטים של PTB
+    msg = data.get("message") or data.get("edited_message")
+    if not msg:
+        return False
+    text = msg.get("text")
+    entities = msg.get("entities")
+    if not text or not entities or text[0] != "/":
+        return False
+    entity = entities[0]
+    if entity.get("type") != "bot_command" or entity.get("offset") != 0:
+        return False
+    command, _, target = text[1:entity.get("length", 0)].partition("@")
+    if command.lower() not in GREETING_COMMANDS:
+        return False
+    return not target or target.lower() == application.bot.username.lower()
+
+def is_greeting_query(data: dict) -> bool:
+    query = data.get("inline_query")
+    return bool(query) and query.get("query", "").strip().lower() in GREETING_COMMANDS
+
+def raw_chat_id(data: dict) -> int:
+    # ל-inline query אין צ'אט - מנתבים לפי המשתמש, כמו route_key
+    if "inline_query" in data:
+        return data["inline_query"]["from"]["id"]
+    msg = data.get("message") or data.get("edited_message") or {}
+    return msg.get("chat", {}).get("id", 0)
+
+def is_stale(data: dict, received: float) -> bool:
+    # טלגרם שולח שוב עדכונים שלא אושרו בזמן - פקודה מלפני דקות כבר לא שווה תשובה.
+    # הגיל נמדד לרגע ההגעה, כך שעדכון שחיכה ב-startup_buffer לא נפסל בגלל cold start
+    if MAX_UPDATE_AGE_SECONDS <= 0:
+        return False
+    msg = data.get("message") or data.get("edited_message") or {}
+    sent_at = msg.get("edit_date") or msg.get("date")
+    return bool(sent_at) and received - sent_at > MAX_UPDATE_AGE_SECONDS
+
+def decode_update(data: dict) -> Optional[Update]:
+    started = time.perf_counter()
+    try:
+        # שליחה חוזרת של עדכון שכבר קיבלנו - None, ורק מאשרים
+        if deduplicator.is_duplicate(data["update_id"]):
+            WEBHOOK_STATS["duplicates"] += 1
+            return None
+        WEBHOOK_STATS["dispatched"] += 1
+        return Update.de_json(data, application.bot)
+    finally:
+        metrics.webhook_decode.observe(time.perf_counter() - started)
+
+async def dispatch_forwarded(data: dict):
+    update = decode_update(data)
+    if update:
+        await application.update_queue.put(update)
+
+def reply_via_webhook(update: Update, method: Optional[dict]) -> bool:
+    # מעביר את הקריאה לתשובת ה-webhook; False אם ה-webhook כבר לא מחכה (timeout / מצב כבוי)
+    reply = webhook_replies.pop(update.update_id, None)
+    if reply is None or reply.done():
+        return False
+    # גם תשובה בגוף ה-webhook נספרת בתקציב של טלגרם; אין token פנוי - נשלח רגיל דרך התור
+    if method and "chat_id" in method and not application.bot.rate_limiter.try_acquire(method["chat_id"]):
+        reply.set_result(None)
+        return False
+    reply.set_result(method)
+    return True
+
 # ====== Handlers ======
 
+async def send_greeting(bot, chat_id: int, text: str, reply_to_id: Optional[int]):
+    # שליחה עם הגדרה מפורשת לעשות Reply
+    try:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_to_message_id=reply_to_id, # כאן הקסם קורה
+            disable_web_page_preview=True
+        )
+    except RetryAfter:
+        # ה-rate limiter כבר ניסה שוב - שליחה נוספת מיד רק תחמיר את ה-flood
+        raise
+    except Exception as e:
+        metrics.swallowed["fallback"] += 1
+        logging.error(f"Error sending message: {e}")
+        # במקרה חירום שבו ה-reply_to_id לא תקף, נשלח בלי reply
+        await bot.send_message(chat_id=chat_id, text=text)
+
+def debounce_command(chat_id: int, reply_to_id: Optional[int], message_id: int) -> bool:
+    # True אם הפקודה נבלעה בחלון שכבר פתוח; אחרת פותח חלון חדש והפקודה מקבלת איחול
+    if cluster is not None:
+        # החלון משותף לכל ה-workers, אז אין רשימה מקומית לסגור - מוחקים דרך ה-buffer כרגיל
+        deletions.add(chat_id, [message_id])
+        return not cluster.claim_debounce_window(chat_id, reply_to_id, DEBOUNCE_SECONDS)
+    key = (chat_id, reply_to_id)
+    window = debounce_windows.get(key)
+    if window is not None:
+        window.append(message_id)
+        return True
+    debounce_windows[key] = [message_id]
+    asyncio.get_running_loop().call_later(DEBOUNCE_SECONDS, close_debounce_window, key)
+    return False
+
+def close_debounce_window(key: tuple[int, Optional[int]]):
+    message_ids = debounce_windows.pop(key, None)
+    if message_ids:
+        deletions.add(key[0], message_ids)
+
+def flush_debounce_windows():
+    while debounce_windows:
+        key, message_ids = debounce_windows.popitem()
+        deletions.add(key[0], message_ids)
+
 async def handle_greeting(update: Update, context: ContextTypes.DEFAULT_TYPE, is_female: bool):
     chat = update.effective_chat
     user = update.effective_user
     msg = update.effective_message
     
     if not chat or not msg:
+        reply_via_webhook(update, None)
         return
 
     # מניעת הפעלה עצמית של המשתמש המיוחד
     if is_special_user(user):
-        try:
-            await context.bot.delete_message(chat_id=chat.id, message_id=msg.message_id)
-        except: pass
+        reply_via_webhook(update, None)
+        deletions.add(chat.id, [msg.message_id])
         return
 
     # בדיקה למי עונים - שליפת הודעת המקור
@@ -336,67 +1034,374 @@ async def handle_greeting(update: Update, context: ContextTypes.DEFAULT_TYPE, is
     # ה-ID של ההודעה שעליה נגיב (אם זו לא תגובה, הבוט פשוט ישלח הודעה רגילה)
     reply_to_id = reply_to_msg.message_id if reply_to_msg else None
 
+    # ספאם של פקודות על אותה הודעה - רק הראשונה בחלון מקבלת איחול
+    if DEBOUNCE_SECONDS > 0 and debounce_command(chat.id, reply_to_id, msg.message_id):
+        reply_via_webhook(update, None)
+        return
+
     # בחירת טקסט האיחול
     if chat.id in SPECIAL_CHAT_IDS:
-        text = random.choice(GREETINGS_HF if is_female else GREETINGS_HM)
+        pool = "hf" if is_female else "hm"
     elif is_special_user(replied_user):
-        text = random.choice(GREETINGS_HF if is_female else GREETINGS_HM)
+        pool = "hf" if is_female else "hm"
     else:
-        text = pick_random_greeting(is_female)
+        pool = "f" if is_female else "m"
+    text = greetings.pick(chat.id, pool)
 
-    # שליחה עם הגדרה מפורשת לעשות Reply
-    try:
-        await context.bot.send_message(
-            chat_id=chat.id,
-            text=text,
-            reply_to_message_id=reply_to_id, # כאן הקסם קורה
-            disable_web_page_preview=True
-        )
-    except Exception as e:
-        logging.error(f"Error sending message: {e}")
-        # במקרה חירום שבו ה-reply_to_id לא תקף, נשלח בלי reply
-        await context.bot.send_message(chat_id=chat.id, text=text)
+    # במצב WEBHOOK_REPLY ה-sendMessage חוזר בתשובת ה-webhook
+    method = {
+        "method": "sendMessage",
+        "chat_id": chat.id,
+        "text": text,
+        "disable_web_page_preview": True,
+        # מחליף את ה-fallback: אם ה-reply_to_id לא תקף טלגרם ישלח בלי reply
+        "allow_sending_without_reply": True,
+    }
+    if reply_to_id:
+        method["reply_to_message_id"] = reply_to_id
 
-    # מחיקת הודעת הפקודה שלך כדי לשמור על סדר
-    try:
-        await context.bot.delete_message(chat_id=chat.id, message_id=msg.message_id)
-    except: pass
+    # מחיקת הודעת הפקודה שלך כדי לשמור על סדר (עם debounce - כשהחלון נסגר, יחד עם כל החלון)
+    if DEBOUNCE_SECONDS <= 0:
+        deletions.add(chat.id, [msg.message_id])
+    if not reply_via_webhook(update, method):
+        await send_greeting(context.bot, chat.id, text, reply_to_id)
+    if "first_reply" not in STARTUP_PROFILE:
+        STARTUP_PROFILE["first_reply"] = time.perf_counter() - IMPORT_STARTED
 
 async def greet_at(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await handle_greeting(update, context, is_female=True)
+    started = time.perf_counter()
+    try:
+        await handle_greeting(update, context, is_female=True)
+    finally:
+        metrics.handler["at"].observe(time.perf_counter() - started)
 
 async def greet_ata(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await handle_greeting(update, context, is_female=False)
+    started = time.perf_counter()
+    try:
+        await handle_greeting(update, context, is_female=False)
+    finally:
+        metrics.handler["ata"].observe(time.perf_counter() - started)
+
+def inline_page(pool: str, page: int) -> tuple[list[dict], str, str]:
+    # כל מאגר נבנה פעם אחת לכל גרסה של greetings.txt; בשאילתה רק בוחרים דף מוכן
+    version = greetings.state[0]
+    cached = inline_pages.get(pool)
+    if cached is None or cached[0] != version:
+        texts = greetings.pool(pool)
+        random.shuffle(texts)
+        results = [
+            InlineQueryResultArticle(
+                id=f"{pool}{version}-{i}",
+                title=text,
+                input_message_content=InputTextMessageContent(text, disable_web_page_preview=True),
+            ).to_dict()
+            for i, text in enumerate(texts)
+        ]
+        pages = [results[i:i + INLINE_PAGE_SIZE] for i in range(0, len(results), INLINE_PAGE_SIZE)]
+        cached = inline_pages[pool] = (version, [(p, json_dumps(p).decode()) for p in pages])
+    pages = cached[1]
+    if page >= len(pages):
+        return [], "[]", ""
+    results, encoded = pages[page]
+    return results, encoded, str(page + 1) if page + 1 < len(pages) else ""
+
+async def handle_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    greetings.maybe_reload()
+    answer = {"method": "answerInlineQuery", "inline_query_id": query.id, "cache_time": INLINE_CACHE_SECONDS}
+    if is_special_user(query.from_user):
+        # כמו ב-/at: המשתמש המיוחד לא מפעיל את הבוט. התשובה הריקה אישית כדי שלא תישמר
+        # ב-cache המשותף של השאילתה ותסתיר את האיחולים משאר המשתמשים
+        answer.update(results=[], is_personal=True)
+        encoded = "[]"
+    else:
+        # ב-inline אין צ'אט ואין הודעה שעונים עליה, כך ש-SPECIAL_CHAT_IDS והמאגרים
+        # המיוחדים לא רלוונטיים - התוצאות זהות לכולם ונשמרות ב-cache המשותף
+        pool = "f" if query.query.strip().lower() == "at" else "m"
+        page = int(query.offset) if query.offset.isdigit() else 0
+        results, encoded, next_offset = inline_page(pool, page)
+        answer.update(results=results, next_offset=next_offset)
+    if not reply_via_webhook(update, answer):
+        params = {k: v for k, v in answer.items() if k != "method"}
+        params["results"] = encoded
+        await context.bot.do_api_request("answerInlineQuery", api_kwargs=params)
+
+async def greet_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
+    try:
+        await handle_inline(update, context)
+    finally:
+        metrics.handler["inline"].observe(time.perf_counter() - started)
 
 # ====== Lifecycle ======
 
+async def poll_updates():
+    bot = application.bot
+    # getUpdates נדחה (409) כל עוד יש webhook רשום
+    await bot.delete_webhook()
+    offset = 0
+    while True:
+        try:
+            batch = await bot.do_api_request(
+                "getUpdates",
+                api_kwargs={"offset": offset, "limit": POLL_LIMIT, "timeout": POLL_TIMEOUT,
+                            "allowed_updates": POLL_ALLOWED_UPDATES},
+                read_timeout=POLL_TIMEOUT + BOT_READ_TIMEOUT,
+            )
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except Exception:
+            logging.exception("getUpdates failed")
+            await asyncio.sleep(1)
+            continue
+        if not batch:
+            continue
+        received = time.time()
+        POLL_STATS["batches"] += 1
+        POLL_STATS["updates"] += len(batch)
+        # אותו מסנן כמו ב-webhook על ה-dict הגולמי, ואז כל ה-batch נכנס לתורים של הצ'אטים
+        # לפי הסדר - צ'אטים שונים רצים במקביל, ובתוך צ'אט הסדר נשמר
+        tasks = []
+        for data in batch:
+            update = await accept_update(data, time.perf_counter(), received)
+            if update:
+                tasks.append(asyncio.create_task(
+                    application.update_processor.process_update(update, application.process_update(update))
+                ))
+        if tasks:
+            _, still_running = await asyncio.wait(tasks, timeout=POLL_COMMIT_TIMEOUT)
+            if still_running:
+                POLL_STATS["commit_timeouts"] += 1
+        # ה-offset מאשר לטלגרם את ה-batch רק בקריאה הבאה - אחרי הטיפול
+        offset = batch[-1]["update_id"] + 1
+
+async def retry_startup_step(name: str, step, attempts: int = 5):
+    # אחרי שינה הרשת לפעמים עוד לא מוכנה - כל קריאה לטלגרם בעלייה מקבלת כמה ניסיונות
+    for attempt in range(attempts):
+        try:
+            return await step()
+        except Exception:
+            if attempt == attempts - 1:
+                raise
+            logging.exception(f"Bot {name} failed, retrying")
+            await asyncio.sleep(2 ** attempt)
+
+async def register_webhook(webhook_url: str):
+    # ה-webhook נשמר אצל טלגרם בין הפעלות - רושמים מחדש רק אם הכתובת השתנתה
+    info = await application.bot.get_webhook_info()
+    if info.url != webhook_url:
+        await application.bot.set_webhook(url=webhook_url)
+        logging.info(f"Webhook set to: {webhook_url}")
+    else:
+        logging.info(f"Webhook already set to: {webhook_url}")
+
+async def start_bot():
+    global poller_task
+    started = time.perf_counter()
+    # getMe ב-initialize הוא הקריאה הראשונה לטלגרם
+    await retry_startup_step("initialize", application.initialize)
+    STARTUP_PROFILE["initialize"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await application.start()
+    if cluster:
+        await cluster.start(dispatch_forwarded)
+    STARTUP_PROFILE["start"] = time.perf_counter() - started
+
+    # ב-multi-worker רק slot 0 מנהל את רישום ה-webhook
+    started = time.perf_counter()
+    if UPDATE_MODE == "webhook" and PUBLIC_URL and (cluster is None or cluster.slot == 0):
+        webhook_url = f"{PUBLIC_URL.rstrip('/')}/webhook/{WEBHOOK_SECRET}"
+        await retry_startup_step("webhook registration", lambda: register_webhook(webhook_url))
+    elif UPDATE_MODE == "polling" and (cluster is None or cluster.slot == 0):
+        # ב-multi-worker רק slot 0 מושך, ומעביר לשאר ה-workers כמו ב-webhook
+        poller_task = asyncio.create_task(poll_updates())
+        logging.info("Polling for updates (no PUBLIC_URL)")
+    STARTUP_PROFILE["webhook"] = time.perf_counter() - started
+
+    STARTUP_PROFILE["ready"] = time.perf_counter() - IMPORT_STARTED
+    logging.info("Startup profile: " + ", ".join(f"{k}={v:.3f}s" for k, v in STARTUP_PROFILE.items()))
+    if startup_buffer:
+        logging.info(f"Processing {len(startup_buffer)} updates received during startup")
+    # מה שמגיע בזמן הריקון נכנס לסוף התור, כך שהסדר בכל צ'אט נשמר
+    while startup_buffer:
+        body, received = startup_buffer.popleft()
+        await ingest_update(body, webhook_reply=False, received=received)
+    bot_ready.set()
+
+async def run_fast_start():
+    global startup_failed
+    try:
+        await start_bot()
+    except Exception:
+        # עד שהתהליך יורד ה-webhook וה-health מחזירים 503, וטלגרם ישלח שוב את מה שלא אושר
+        startup_failed = True
+        WEBHOOK_STATS["startup_dropped"] += len(startup_buffer)
+        logging.exception(f"Bot startup failed, {len(startup_buffer)} buffered updates lost - exiting")
+        startup_buffer.clear()
+        # תהליך שלא הצליח לעלות לא יתאושש לבד - יוצאים, וה-host מפעיל אותו מחדש
+        os.kill(os.getpid(), signal.SIGTERM)
+
 @api.on_event("startup")
 async def on_startup():
+    global startup_task
     application.add_handler(CommandHandler("at", greet_at))
     application.add_handler(CommandHandler("ata", greet_ata))
-    
-    await application.initialize()
-    await application.start()
+    application.add_handler(InlineQueryHandler(greet_inline, pattern=rf"(?i)^\s*({'|'.join(GREETING_COMMANDS)})\s*$"))
 
-    if PUBLIC_URL:
-        webhook_url = f"{PUBLIC_URL.rstrip('/')}/webhook/{WEBHOOK_SECRET}"
-        await application.bot.set_webhook(url=webhook_url)
-        logging.info(f"Webhook set to: {webhook_url}")
+    if FAST_START:
+        startup_task = asyncio.create_task(run_fast_start())
+    else:
+        await start_bot()
 
 @api.on_event("shutdown")
 async def on_shutdown():
-    await application.stop()
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+        await asyncio.gather(startup_task, return_exceptions=True)
+    if poller_task:
+        poller_task.cancel()
+        await asyncio.gather(poller_task, return_exceptions=True)
+    if cluster:
+        await cluster.stop()
+    # application.stop מחכה ל-handlers שבדרך, וב-multi-worker הם עוד צריכים את ה-DB של ה-cluster
+    if application.running:
+        await application.stop()
+    flush_debounce_windows()
+    await deletions.drain()
     await application.shutdown()
+    if cluster:
+        cluster.close()
+    deduplicator.close()
 
 @api.get("/")
 async def health():
-    return {"status": "greetings-bot-active"}
+    if startup_failed:
+        return JSONResponse({"status": "startup-failed", "ready": False}, status_code=503)
+    return {"status": "greetings-bot-active", "ready": bot_ready.is_set()}
+
+@api.get("/stats")
+async def stats():
+    return {
+        "webhook": WEBHOOK_STATS,
+        "polling": POLL_STATS if UPDATE_MODE == "polling" else None,
+        "workers": application.update_processor.stats(),
+        "ingress": {
+            "pending": application.update_processor.pending,
+            "chats": len(application.update_processor.chats),
+            "throttled": application.update_processor.throttled,
+            "high_water": application.update_processor.high_water,
+            "shed": application.update_processor.shed,
+        },
+        "rate_limiter": application.bot.rate_limiter.stats(),
+        "cluster": cluster.stats() if cluster else None,
+        "greetings": {"version": greetings.state[0], "shuffle_bags": len(greetings.bags)},
+        "startup": {**STARTUP_PROFILE, "buffered": len(startup_buffer)},
+    }
+
+@api.get("/metrics")
+async def prometheus_metrics():
+    lines = [
+        "# TYPE sticky_webhook_updates_total counter",
+        *(f'sticky_webhook_updates_total{{result="{k}"}} {v}' for k, v in WEBHOOK_STATS.items()),
+        "# TYPE sticky_webhook_parse_seconds histogram",
+        *metrics.webhook_parse.render("sticky_webhook_parse_seconds"),
+        "# TYPE sticky_webhook_decode_seconds histogram",
+        *metrics.webhook_decode.render("sticky_webhook_decode_seconds"),
+        "# TYPE sticky_update_queue_depth gauge",
+        f'sticky_update_queue_depth{{worker="ingress"}} {application.update_queue.qsize()}',
+    ]
+    workers = application.update_processor.stats()
+    lines += [f'sticky_update_queue_depth{{worker="{w["worker"]}"}} {w["queued"]}' for w in workers]
+    lines.append(f'sticky_update_queue_depth{{worker="pending"}} {application.update_processor.pending}')
+    if UPDATE_MODE == "polling":
+        lines.append("# TYPE sticky_poll_total counter")
+        lines += [f'sticky_poll_total{{kind="{k}"}} {v}' for k, v in POLL_STATS.items()]
+    lines.append("# TYPE sticky_update_queue_high_water gauge")
+    lines.append(f"sticky_update_queue_high_water {application.update_processor.high_water}")
+    lines.append("# TYPE sticky_updates_shed_total counter")
+    lines += [f'sticky_updates_shed_total{{reason="{r}"}} {v}' for r, v in application.update_processor.shed.items()]
+    lines.append("# TYPE sticky_updates_in_flight gauge")
+    lines += [f'sticky_updates_in_flight{{worker="{w["worker"]}"}} {w["in_flight"]}' for w in workers]
+    lines.append("# TYPE sticky_update_queue_wait_seconds histogram")
+    lines += metrics.queue_wait.render("sticky_update_queue_wait_seconds")
+    lines.append("# TYPE sticky_handler_seconds histogram")
+    for command, histogram in metrics.handler.items():
+        lines += histogram.render("sticky_handler_seconds", f'command="{command}"')
+    lines.append("# TYPE sticky_bot_api_seconds histogram")
+    for method, histogram in metrics.bot_api.items():
+        lines += histogram.render("sticky_bot_api_seconds", f'method="{method}"')
+    lines.append("# TYPE sticky_bot_api_errors_total counter")
+    lines += [f'sticky_bot_api_errors_total{{method="{m}"}} {v}' for m, v in metrics.bot_api_errors.items()]
+    lines.append("# TYPE sticky_swallowed_errors_total counter")
+    lines += [f'sticky_swallowed_errors_total{{path="{p}"}} {v}' for p, v in metrics.swallowed.items()]
+    lines.append("# TYPE sticky_rate_limit_wait_seconds summary")
+    for priority, (calls, total, _) in application.bot.rate_limiter.waits.items():
+        lines.append(f'sticky_rate_limit_wait_seconds_sum{{priority="{priority}"}} {total}')
+        lines.append(f'sticky_rate_limit_wait_seconds_count{{priority="{priority}"}} {calls}')
+    lines.append("# TYPE sticky_startup_seconds gauge")
+    lines += [f'sticky_startup_seconds{{phase="{phase}"}} {v}' for phase, v in STARTUP_PROFILE.items()]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
 
 @api.post("/webhook/{secret}")
 async def telegram_webhook(secret: str, request: Request):
     if secret != WEBHOOK_SECRET:
         return {"ok": False}
-    data = await request.json()
-    update = Update.de_json(data, application.bot)
+    started = time.perf_counter()
+    body = await request.body()
+    if not bot_ready.is_set():
+        if startup_failed:
+            # בלי ack - טלגרם ישמור את העדכון וישלח שוב כשהשירות יעלה מחדש
+            return JSONResponse({"ok": False}, status_code=503)
+        # הבוט עוד עולה (FAST_START) - שומרים בצד ומאשרים מיד כדי שטלגרם לא ישלח שוב
+        if len(startup_buffer) == startup_buffer.maxlen:
+            # ה-deque זורק את הישן ביותר
+            WEBHOOK_STATS["startup_dropped"] += 1
+        startup_buffer.append((body, time.time()))
+        return {"ok": True}
+    return await ingest_update(body, WEBHOOK_REPLY, started=started)
+
+async def accept_update(data: dict, started: float, received: float, body: Optional[bytes] = None) -> Optional[Update]:
+    # מסנן משותף ל-webhook ול-polling; None - העדכון כבר טופל (נזרק, הועבר או כפול)
+    # רוב העדכונים בקבוצה הם לא /at או /ata - מאשרים אותם מיד
+    is_command = is_greeting_command(data) or is_greeting_query(data)
+    metrics.webhook_parse.observe(time.perf_counter() - started)
+    if not is_command:
+        WEBHOOK_STATS["dropped"] += 1
+        return None
+    if is_stale(data, received):
+        WEBHOOK_STATS["stale"] += 1
+        return None
+    # צ'אט של worker אחר - מעבירים אליו כמו שהוא (בלי תשובה בגוף ה-webhook)
+    if cluster and cluster.slot is not None:
+        owner = cluster.owner(raw_chat_id(data))
+        if owner != cluster.slot and await cluster.forward(owner, body or json_dumps(data)):
+            return None
+    return decode_update(data)
+
+async def ingest_update(
+    body: bytes, webhook_reply: bool, received: Optional[float] = None, started: Optional[float] = None
+):
+    # עדכון מה-buffer של ההפעלה נמדד מרגע שמתחילים לטפל בו, לא מרגע שהגיע
+    started = started or time.perf_counter()
+    update = await accept_update(json_loads(body), started, received or time.time(), body)
+    if update is None:
+        return {"ok": True}
+    if not webhook_reply:
+        await application.update_queue.put(update)
+        return {"ok": True}
+
+    # מחכים ל-handler ומחזירים את ה-sendMessage כגוף התשובה
+    reply = asyncio.get_running_loop().create_future()
+    webhook_replies[update.update_id] = reply
     await application.update_queue.put(update)
-    return {"ok": True}
+    try:
+        method = await asyncio.wait_for(reply, WEBHOOK_REPLY_TIMEOUT)
+    except asyncio.TimeoutError:
+        # handler איטי - הוא ישלח בעצמו דרך ה-HTTP client
+        webhook_replies.pop(update.update_id, None)
+        return {"ok": True}
+    return method or {"ok": True}
+
+STARTUP_PROFILE["module"] = time.perf_counter() - IMPORT_STARTED
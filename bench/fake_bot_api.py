@@ -0,0 +1,138 @@
+"""Local stand-in for api.telegram.org used by the benchmarks.
+
+Records every Bot API call (method, params, receive/finish time) and can inject
+latency, server errors and 429 flood-control answers. Updates POSTed to /_updates
+are served through getUpdates (long polling, offset confirmation, allowed_updates).
+
+Run standalone:  python bench/fake_bot_api.py --port 8081 --latency 0.05 --flood-rate 0.01
+and point the bot at it with BOT_API_BASE_URL=http://127.0.0.1:8081/bot
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import random
+import time
+from urllib.parse import parse_qsl
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "BenchBot"}
+# קריאות שלא מקבלות השהיה/שגיאות - רק ה-bootstrap של הבוט
+BOOTSTRAP_METHODS = {"getMe", "getWebhookInfo", "setWebhook", "deleteWebhook"}
+
+
+def create_app(latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+               flood_rate: float = 0.0, retry_after: int = 1, seed: int = 0) -> FastAPI:
+    fake = FastAPI()
+    calls = []
+    next_message_id = [1_000_000]
+    next_update_id = [0]
+    rng = random.Random(seed)
+    # עדכונים שעוד לא אושרו ב-offset, כמו התור של טלגרם ל-getUpdates
+    pending = collections.deque()
+    arrived = asyncio.Event()
+
+    @fake.get("/_calls")
+    async def get_calls():
+        return calls
+
+    @fake.post("/_reset")
+    async def reset():
+        calls.clear()
+        pending.clear()
+        return {"ok": True}
+
+    @fake.post("/_updates")
+    async def push_updates(request: Request):
+        updates = await request.json()
+        for update in updates if isinstance(updates, list) else [updates]:
+            # כמו בטלגרם: update_id לפי סדר ההגעה (בקשות מקבילות לא תמיד מגיעות לפי הסדר)
+            next_update_id[0] += 1
+            pending.append({**update, "update_id": next_update_id[0]})
+        arrived.set()
+        return {"ok": True}
+
+    async def get_updates(data: dict) -> list:
+        offset = int(data.get("offset", 0))
+        while pending and pending[0]["update_id"] < offset:
+            pending.popleft()
+        if not pending:
+            arrived.clear()
+            try:
+                await asyncio.wait_for(arrived.wait(), float(data.get("timeout", 0)))
+            except asyncio.TimeoutError:
+                return []
+        allowed = data.get("allowed_updates")
+        if isinstance(allowed, str):
+            allowed = json.loads(allowed)
+        if allowed:
+            # טלגרם בכלל לא שומר עדכונים מסוג שלא ביקשו
+            kept = [u for u in pending if not u.keys().isdisjoint(allowed)]
+            pending.clear()
+            pending.extend(kept)
+        return list(itertools.islice(pending, int(data.get("limit", 100))))
+
+    @fake.post("/bot{token}/{method}")
+    async def bot_method(token: str, method: str, request: Request):
+        body = await request.body()
+        if "json" in request.headers.get("content-type", ""):
+            data = json.loads(body or b"{}")
+        else:
+            data = dict(parse_qsl(body.decode()))
+        received = time.time()
+
+        if method == "getUpdates":
+            return {"ok": True, "result": await get_updates(data)}
+        if method == "getMe":
+            return {"ok": True, "result": BOT_USER}
+        if method == "getWebhookInfo":
+            return {"ok": True, "result": {"url": "", "has_custom_certificate": False,
+                                           "pending_update_count": 0}}
+        if method in BOOTSTRAP_METHODS:
+            return {"ok": True, "result": True}
+
+        delay = latency + (rng.uniform(0, jitter) if jitter else 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        call = {"method": method, "data": data, "received": received, "done": time.time(),
+                "status": 200}
+        calls.append(call)
+
+        roll = rng.random()
+        if roll < flood_rate:
+            call["status"] = 429
+            return JSONResponse({"ok": False, "error_code": 429,
+                                 "description": f"Too Many Requests: retry after {retry_after}",
+                                 "parameters": {"retry_after": retry_after}}, status_code=429)
+        if roll < flood_rate + error_rate:
+            call["status"] = 500
+            return JSONResponse({"ok": False, "error_code": 500,
+                                 "description": "Internal Server Error"}, status_code=500)
+
+        if method == "sendMessage":
+            next_message_id[0] += 1
+            chat = {"id": int(data["chat_id"]), "type": "supergroup", "title": "bench"}
+            return {"ok": True, "result": {"message_id": next_message_id[0], "date": int(received),
+                                           "chat": chat, "from": BOT_USER, "text": data.get("text")}}
+        return {"ok": True, "result": True}
+
+    return fake
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random 0..jitter seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered 500")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of calls answered 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    app = create_app(args.latency, args.jitter, args.error_rate, args.flood_rate,
+                     args.retry_after, args.seed)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
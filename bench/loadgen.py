@@ -0,0 +1,307 @@
+"""Offline load test for the webhook -> update_queue -> handle_greeting path.
+
+Starts bench/fake_bot_api.py and the bot (uvicorn app:api) as subprocesses, POSTs a
+realistic mix of webhook updates to /webhook/{secret} at a fixed rate and reports
+throughput, end-to-end latency (webhook POST -> sendMessage reaching the fake Bot API)
+and memory growth of the bot process. With --polling the same traffic is queued in the
+fake Bot API instead and the bot pulls it through getUpdates.
+
+    python bench/loadgen.py --rate 200 --duration 20 --latency 0.05 --save bench/baseline.json
+    python bench/loadgen.py --rate 200 --duration 20 --latency 0.05 --compare bench/baseline.json
+    python bench/loadgen.py --bot-env WEBHOOK_REPLY=1 --bot-env DEBOUNCE_SECONDS=0.6 --flood-rate 0.01
+    python bench/loadgen.py --polling --rate 200 --duration 20 --compare bench/baseline.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET = "bench"
+# כמו ב-app.py
+SPECIAL_USER_ID = 919782824
+SPECIAL_CHAT_ID = -1003741813693
+SENDER = {"id": 5, "is_bot": False, "first_name": "sender"}
+TARGET = {"id": 7, "is_bot": False, "first_name": "target"}
+
+
+class Traffic:
+    # מייצר עדכונים בפורמט של טלגרם ושומר מה כל פקודה מצפה לקבל בחזרה
+    def __init__(self, mix: dict, chats: int, seed: int):
+        self.rng = random.Random(seed)
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.chat_ids = [-1_001_000_000_000 - i for i in range(chats)]
+        self.update_id = 0
+        self.message_id = 0
+
+    def _message(self, chat_id: int, sender: dict, text: str, entities: list = None,
+                 reply_to: dict = None) -> dict:
+        self.message_id += 1
+        msg = {"message_id": self.message_id, "date": int(time.time()), "text": text,
+               "chat": {"id": chat_id, "type": "supergroup", "title": "bench"}, "from": sender}
+        if entities:
+            msg["entities"] = entities
+        if reply_to:
+            msg["reply_to_message"] = reply_to
+        return msg
+
+    def _command(self, chat_id: int, sender: dict, reply: bool) -> tuple:
+        text = self.rng.choice(("/at", "/ata"))
+        if self.rng.random() < 0.1:
+            text += "@BenchBot"
+        target = self._message(chat_id, TARGET, "hi") if reply else None
+        msg = self._message(chat_id, sender, text,
+                            [{"type": "bot_command", "offset": 0, "length": len(text)}], target)
+        return msg, target["message_id"] if target else None
+
+    def next(self) -> tuple:
+        # (update, kind, key): key מזהה את התשובה הצפויה, None אם לא מצפים לתשובה
+        self.update_id += 1
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        chat_id = self.rng.choice(self.chat_ids)
+        update = {"update_id": self.update_id}
+        key = None
+        if kind == "commands":
+            update["message"], _ = self._command(chat_id, SENDER, reply=False)
+            key = (chat_id, None)
+        elif kind == "replies":
+            update["message"], target_id = self._command(chat_id, SENDER, reply=True)
+            key = (chat_id, target_id)
+        elif kind == "special":
+            if self.rng.random() < 0.5:
+                update["message"], target_id = self._command(SPECIAL_CHAT_ID, SENDER, reply=True)
+                key = (SPECIAL_CHAT_ID, target_id)
+            else:
+                # המשתמש המיוחד - הפקודה רק נמחקת
+                update["message"], _ = self._command(chat_id, {**SENDER, "id": SPECIAL_USER_ID},
+                                                     reply=True)
+        else:
+            noise = self.rng.random()
+            if noise < 0.6:
+                update["message"] = self._message(chat_id, SENDER, "סתם הודעה בקבוצה")
+            elif noise < 0.8:
+                update["edited_message"] = self._message(chat_id, SENDER, "הודעה ערוכה")
+            elif noise < 0.9:
+                update["message"] = self._message(chat_id, SENDER, "/start", [
+                    {"type": "bot_command", "offset": 0, "length": 6}])
+            else:
+                update["message_reaction"] = {
+                    "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+                    "message_id": self.message_id, "user": SENDER, "date": int(time.time()),
+                    "old_reaction": [], "new_reaction": [{"type": "emoji", "emoji": "👍"}]}
+        return update, kind, key
+
+
+def reply_key(data: dict) -> tuple:
+    chat_id = int(data["chat_id"])
+    target = data.get("reply_to_message_id")
+    if target is None and data.get("reply_parameters"):
+        params = data["reply_parameters"]
+        target = (json.loads(params) if isinstance(params, str) else params).get("message_id")
+    return chat_id, int(target) if target is not None else None
+
+
+def rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def percentile(values: list, pct: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def start(args: list, env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, *args], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str):
+    for _ in range(400):
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def run(args) -> dict:
+    fake_url = f"http://127.0.0.1:{args.fake_port}"
+    bot_url = f"http://127.0.0.1:{args.port}"
+    env = dict(os.environ, BOT_TOKEN="123:bench", WEBHOOK_SECRET=SECRET,
+               BOT_API_BASE_URL=f"{fake_url}/bot")
+    env.pop("PUBLIC_URL", None)
+    env["UPDATE_MODE"] = "polling" if args.polling else "webhook"
+    env.update(kv.split("=", 1) for kv in args.bot_env)
+    fake = start(["bench/fake_bot_api.py", "--port", str(args.fake_port),
+                  "--latency", str(args.latency), "--jitter", str(args.jitter),
+                  "--error-rate", str(args.error_rate), "--flood-rate", str(args.flood_rate),
+                  "--retry-after", str(args.retry_after), "--seed", str(args.seed)])
+    bot = start(["-m", "uvicorn", "app:api", "--port", str(args.port), "--log-level", "warning"],
+                env)
+    traffic = Traffic(args.mix, args.chats, args.seed)
+    expected = {}  # key -> [post times] (פקודות בלי reply באותו צ'אט נענות לפי הסדר)
+    replied = {}   # key -> [reply times]
+    acks, kinds, rss = [], collections.Counter(), []
+    try:
+        limits = httpx.Limits(max_connections=args.connections)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            await wait_ready(client, f"{fake_url}/_calls")
+            await wait_ready(client, f"{bot_url}/")
+            await client.post(f"{fake_url}/_reset")
+            rss.append(rss_kb(bot.pid))
+
+            async def post(update: dict, key):
+                sent = time.time()
+                if args.polling:
+                    response = await client.post(f"{fake_url}/_updates", json=update)
+                else:
+                    response = await client.post(f"{bot_url}/webhook/{SECRET}", json=update)
+                acks.append(time.time() - sent)
+                body = response.json()
+                # מצב WEBHOOK_REPLY: התשובה חוזרת בגוף ה-webhook ולא מגיעה ל-fake API
+                if body.get("method") == "sendMessage":
+                    replied.setdefault(reply_key(body), []).append(time.time())
+
+            total = int(args.rate * args.duration)
+            started = time.time()
+            tasks = []
+            for i in range(total):
+                delay = started + i / args.rate - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                update, kind, key = traffic.next()
+                kinds[kind] += 1
+                if key:
+                    expected.setdefault(key, []).append(time.time())
+                tasks.append(asyncio.create_task(post(update, key)))
+                if i % max(1, int(args.rate)) == 0:
+                    rss.append(rss_kb(bot.pid))
+            await asyncio.gather(*tasks)
+            sent_done = time.time()
+
+            # מחכים שהתור יתרוקן: אין קריאות חדשות ל-fake API במשך --settle שניות
+            calls, idle_since = [], time.time()
+            while time.time() - idle_since < args.settle:
+                await asyncio.sleep(0.25)
+                latest = (await client.get(f"{fake_url}/_calls")).json()
+                if len(latest) != len(calls):
+                    calls, idle_since = latest, time.time()
+            rss.append(rss_kb(bot.pid))
+    finally:
+        for proc in (bot, fake):
+            proc.terminate()
+            proc.wait()
+
+    methods = collections.Counter(f"{c['method']}:{c['status']}" for c in calls)
+    for call in calls:
+        if call["method"] == "sendMessage" and call["status"] == 200:
+            replied.setdefault(reply_key(call["data"]), []).append(call["received"])
+
+    latencies, missing = [], 0
+    last_reply = started
+    for key, posts in expected.items():
+        replies = sorted(replied.get(key, []))
+        for posted, reply in zip(posts, replies):
+            latencies.append((reply - posted) * 1000)
+            last_reply = max(last_reply, reply)
+        missing += max(0, len(posts) - len(replies))
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+        "updates": sum(kinds.values()),
+        "mix": dict(kinds),
+        "offered_rate": round(sum(kinds.values()) / (sent_done - started), 1),
+        "replies": len(latencies),
+        "missing_replies": missing,
+        "reply_throughput": round(len(latencies) / max(last_reply - started, 1e-9), 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "mean": round(statistics.mean(latencies), 1) if latencies else 0.0,
+            "max": round(max(latencies), 1) if latencies else 0.0,
+        },
+        "ack_ms": {"p50": round(percentile(acks, 50) * 1000, 1),
+                   "p99": round(percentile(acks, 99) * 1000, 1)},
+        "api_calls": dict(sorted(methods.items())),
+        "rss_kb": {"start": rss[0], "peak": max(rss), "end": rss[-1], "growth": rss[-1] - rss[0]},
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    print(f"{'metric':<24}{'baseline':>12}{'now':>12}{'delta':>10}")
+    rows = [("latency_ms." + p, True) for p in ("p50", "p95", "p99")]
+    rows += [("reply_throughput", False), ("rss_kb.growth", True)]
+    for name, lower_is_better in rows:
+        old, new = baseline, report
+        for part in name.split("."):
+            old, new = old[part], new[part]
+        delta = (new - old) / old if old else 0.0
+        worse = delta > tolerance if lower_is_better else delta < -tolerance
+        # זיכרון: מתעלמים מתנודות קטנות מ-1MB
+        if name == "rss_kb.growth" and abs(new - old) < 1024:
+            worse = False
+        ok = ok and not worse
+        print(f"{name:<24}{old:>12}{new:>12}{delta:>+9.0%}{'  <-- regression' if worse else ''}")
+    return ok
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, weight = part.split("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=100, help="webhook updates per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("commands=0.1,replies=0.15,special=0.02,noise=0.73"))
+    parser.add_argument("--chats", type=int, default=200, help="number of distinct group chats")
+    parser.add_argument("--connections", type=int, default=64, help="max open webhook connections")
+    parser.add_argument("--settle", type=float, default=3.0,
+                        help="stop after this many seconds without new Bot API calls")
+    parser.add_argument("--polling", action="store_true", help="feed updates through getUpdates")
+    parser.add_argument("--bot-env", action="append", default=[], metavar="KEY=VALUE")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--fake-port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the report as JSON (e.g. a baseline)")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare) as f:
+            sys.exit(0 if compare(report, json.load(f), args.tolerance) else 1)